@@ -16,5 +16,7 @@ class HTMLOptions(BaseModel):
     scale: float = Field(1.0, gt=0, description="Scaling factor")
     invert: bool = Field(False, description="Invert black and white")
     dpi: int = Field(203, gt=0, description="DPI for conversion (default: 203 for Zebra printers)")
+    strip_remote_assets: bool = Field(True, description="Remove remote stylesheet links and scripts before rendering")
+    render_dpi: Optional[int] = Field(None, gt=0, description="Rasterize at this lower DPI and upscale to dpi (faster, softer edges; defaults to dpi)")
 
 # ... other models from main.py ...
@@ -1,56 +1,409 @@
 import os
+import re
+import math
 import base64
-import tempfile
-from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Request
+import binascii
+import zlib
+import asyncio
+import threading
+import multiprocessing
+from collections import OrderedDict
+from hashlib import blake2b
+from concurrent.futures import ProcessPoolExecutor
+from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from starlette.concurrency import iterate_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse, ORJSONResponse
 from pydantic import BaseModel, Field
 from typing import Optional, List, Tuple, Dict, Any
 import uvicorn
 import logging
-from datetime import datetime
-import json
-from weasyprint import HTML
-from zebrafy import ZebrafyPDF, ZebrafyZPL  # Update import
+from datetime import datetime, timezone
+import time
+from functools import lru_cache
+from contextlib import asynccontextmanager
+import orjson
+from weasyprint import HTML, CSS
+from weasyprint.text.fonts import FontConfiguration
+from zebrafy import ZebrafyPDF, ZebrafyZPL, ZebrafyImage  # Update import
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-import pdfplumber
 import io
 import requests
 from fastapi.responses import Response
 import fitz  # PyMuPDF
+import pypdfium2 as pdfium
 import pyzbar.pyzbar as pyzbar
 from PIL import Image
 import numpy as np
-from decimal import Decimal
 
-# Setup logging
+# Setup logging. The raw %(created) epoch timestamp avoids a localtime/strftime
+# call per record, and thread/process/caller lookups are switched off since
+# the format never uses them.
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
+logging._srcfile = None
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    format='%(created).3f - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
+
+def memory_limit() -> Optional[int]:
+    """Bytes of memory this process may use: the container's cgroup limit if it has
+    one, else the host's RAM, or None where neither can be read"""
+    limits = []
+    # cgroup v2, then v1; an unlimited group reports "max" or a huge number
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                limits.append(int(f.read().strip()))
+            break
+        except (OSError, ValueError):
+            continue
+    try:
+        limits.append(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES'))
+    except (AttributeError, ValueError, OSError):
+        # No sysconf (e.g. Windows) or the values aren't available
+        pass
+    return min(limits) if limits else None
+
+
 # Get environment variables
 MAX_UPLOAD_SIZE = int(os.getenv('MAX_UPLOAD_SIZE', 10 * 1024 * 1024))  # 10MB default
+MAX_ANALYZE_PAGES = int(os.getenv('MAX_ANALYZE_PAGES', 500))  # pages analyzed per all_pages request
+# Concurrent PDF analyses/scalings per worker (default: one per 2GB of memory, looked
+# up only when unset), and how many more may wait for a slot before requests are
+# turned away with 503
+PDF_CONCURRENCY = int(os.getenv('PDF_CONCURRENCY') or 0) or max(1, (memory_limit() or 0) // (2 << 30))
+PDF_QUEUE_LIMIT = int(os.getenv('PDF_QUEUE_LIMIT', 4 * PDF_CONCURRENCY))
+# uvicorn worker processes, shared here so each one's process pool gets its share of the CPUs
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', os.getenv('WEB_CONCURRENCY', max(2, os.cpu_count() or 2))))
+PDF_POOL_WORKERS = int(os.getenv('PDF_POOL_WORKERS', max(1, (os.cpu_count() or 1) // WEB_WORKERS)))
+BITMAP_CACHE_BYTES = int(os.getenv('BITMAP_CACHE_BYTES', 32 * 1024 * 1024))  # per worker
+ANALYSIS_CACHE_BYTES = int(os.getenv('ANALYSIS_CACHE_BYTES', 32 * 1024 * 1024))  # per worker
+ZPL_CACHE_BYTES = int(os.getenv('ZPL_CACHE_BYTES', 32 * 1024 * 1024))  # per worker
+MUPDF_STORE_SHRINK_INTERVAL = int(os.getenv('MUPDF_STORE_SHRINK_INTERVAL', 60))  # seconds, 0 disables
 
 # Supported file types
 SUPPORTED_FILE_TYPES = ["pdf", "png", "jpg", "jpeg", "html"]
 
+# Content types accepted by /convert/raw, mapped to file types
+RAW_CONTENT_TYPES = {
+    "application/pdf": "pdf",
+    "image/png": "png",
+    "image/jpeg": "jpeg",
+}
+
+# Black pixel threshold for HTML labels, which are never dithered
+HTML_THRESHOLD = 128
+
+# Bit-reversal table for computing the reflected ZPL CRC with binascii.crc_hqx
+_BIT_REVERSE = bytes(int(f"{i:08b}"[::-1], 2) for i in range(256))
+
+
+class LRUCache:
+    """Small thread-safe LRU mapping with a fixed number of entries and, if maxbytes
+    is given, a total size budget (values are measured with sizeof). A value over a
+    quarter of the budget is not cached, so one entry can't flush all the others."""
+
+    def __init__(self, maxsize: int, maxbytes: Optional[int] = None, sizeof=len):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self._data: "OrderedDict[Any, Tuple[Any, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        size = 0 if self.maxbytes is None else self.sizeof(value)
+        if self.maxbytes is not None and size > self.maxbytes // 4:
+            return
+        with self._lock:
+            previous = self._data.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._data[key] = (value, size)
+            self._bytes += size
+            while len(self._data) > self.maxsize or (
+                    self.maxbytes is not None and self._bytes > self.maxbytes):
+                self._bytes -= self._data.popitem(last=False)[1][1]
+
+
+def bitmap_bytes(pages: Tuple[Image.Image, ...]) -> int:
+    """Memory held by rendered page bitmaps (PIL stores mode "1" at a byte per pixel)"""
+    return sum(page.width * page.height for page in pages)
+
+
+# Rendered HTML label bitmaps, keyed by (html digest, dpi, threshold). Output
+# format and inversion are applied at encode time, so requests that differ only
+# in those skip WeasyPrint and rasterization entirely. A 4x6in page at 203dpi is
+# ~1MB, so the cache is bounded by size as well as count.
+_bitmap_cache = LRUCache(maxsize=64, maxbytes=BITMAP_CACHE_BYTES, sizeof=bitmap_bytes)
+
+# Finished HTML label ZPL, keyed by (html digest, label size, dpi, format, invert).
+# Reprints of the same label return without rendering or encoding anything. An
+# ASCII 4x6in label is ~250KB, so the cache is bounded by size as well as count.
+_zpl_cache = LRUCache(maxsize=512, maxbytes=ZPL_CACHE_BYTES)
+
+# Serialized /analyze_pdf responses, keyed by (upload digest, page or None for
+# all pages). Retried or polled uploads are answered without parsing the PDF again.
+# All-pages payloads can be large, so the cache is bounded by size as well as count.
+_analysis_response_cache = LRUCache(maxsize=256, maxbytes=ANALYSIS_CACHE_BYTES)
+
+
+class WorkGate:
+    """Bound how many heavy requests run at once. Once max_waiting more are queued
+    for a slot, further requests get a 503 instead of piling up in memory."""
+
+    def __init__(self, limit: int, max_waiting: int):
+        self.max_waiting = max_waiting
+        self._semaphore = asyncio.Semaphore(limit)
+        self._waiting = 0
+
+    def check(self):
+        """Raise the 503 slot() would, without waiting; lets a streaming response turn
+        a request away while it can still send a status"""
+        if self._semaphore.locked() and self._waiting >= self.max_waiting:
+            raise HTTPException(status_code=503, detail="Server busy, try again shortly",
+                                headers={"Retry-After": "1"})
+
+    @asynccontextmanager
+    async def slot(self):
+        self.check()
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+
+# PDF analysis and scaling, which hold whole documents, pixmaps and results in memory
+pdf_gate = WorkGate(PDF_CONCURRENCY, PDF_QUEUE_LIMIT)
+
+
+# HTML conversions currently running, keyed like _zpl_cache. Identical requests
+# that arrive while a render is in flight await it instead of rendering again.
+_inflight_html: Dict[tuple, "asyncio.Future[str]"] = {}
+
+# Label font, registered once with the shared font config so text in labels
+# resolves to it directly instead of going through fontconfig's fallback search
+LABEL_FONT_PATH = os.getenv("LABEL_FONT_PATH", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf")
+if os.path.isfile(LABEL_FONT_PATH):
+    LABEL_FONT_FACE = f"""
+    @font-face {{
+        font-family: LabelFont;
+        src: url("file://{LABEL_FONT_PATH}");
+    }}
+"""
+    LABEL_FONT_FAMILY = "LabelFont"
+else:
+    LABEL_FONT_FACE = ""
+    LABEL_FONT_FAMILY = "Arial, sans-serif"
+
+# Shared WeasyPrint render context: fonts are loaded once per process and the
+# size-independent label CSS is parsed once at import instead of per request
+FONT_CONFIG = FontConfiguration()
+LABEL_BASE_CSS = CSS(string=LABEL_FONT_FACE + f"""
+    @page {{
+        margin: 0;
+    }}
+    body {{
+        margin: 0;
+        padding: 0;
+        transform-origin: top left;
+        font-family: {LABEL_FONT_FAMILY};
+    }}
+""", font_config=FONT_CONFIG)
+
+
+@lru_cache(maxsize=64)
+def label_page_css(width_mm: float, height_mm: float, scale: float) -> CSS:
+    """Size-specific label CSS, parsed once per label size and scale"""
+    return CSS(string=f"""
+        @page {{
+            size: {width_mm}mm {height_mm}mm;
+        }}
+        body {{
+            transform: scale({scale});
+            width: {width_mm}mm;
+            height: {height_mm}mm;
+        }}
+    """, font_config=FONT_CONFIG)
+
+
+# Wrapper page for HTML labels. The user's body is joined in between without
+# being copied into a format buffer; page size and scale come from label_page_css.
+LABEL_HTML_HEAD = """
+        <html>
+        <head>
+            <meta charset="UTF-8">
+        </head>
+        <body>
+            """
+LABEL_HTML_TAIL = """
+        </body>
+        </html>
+        """
+
+# Remote stylesheets (CDN bundles etc.) that WeasyPrint would fetch and parse on
+# every render, and scripts, which WeasyPrint never executes; see remove_remote_assets
+REMOTE_HREF_RE = re.compile(r'\bhref\s*=\s*["\']?(?:https?:)?//', re.I)
+# Lowercases ASCII letters only, so offsets into the result are offsets into the input
+ASCII_LOWERCASE = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+# A label body that is nothing but one inline PNG/JPEG, e.g. a pre-rendered label
+# or barcode; these skip WeasyPrint and are rasterized directly
+INLINE_IMAGE_RE = re.compile(
+    r'\s*<img\s+src\s*=\s*(["\'])data:image/(?:png|jpe?g);base64,([A-Za-z0-9+/=\s]+)\1\s*/?>\s*',
+    re.I
+)
+
+# A document with no content at all: only a doctype, comments, bare html/head/body
+# tags, meta and title. These render to a blank label without invoking WeasyPrint.
+# No alternative can match across its own closer, so the repetition can't backtrack
+# through earlier matches (a lazy .*? there is exponential on e.g. "<!---->" * 24 + "x").
+BLANK_HTML_RE = re.compile(
+    r'(?:\s|<!doctype[^>]*>|<!--(?:[^-]|-(?!->))*-->|</?(?:html|head|body)\s*>|<meta\b[^>]*>'
+    r'|<title\b[^>]*>(?:[^<]|<(?!/title\s*>))*</title\s*>)*',
+    re.I
+)
+
+# Slice size for streamed ZPL responses
+ZPL_STREAM_CHUNK_SIZE = 64 * 1024
+
+# PDFium is not thread-safe and pypdfium2 releases the GIL inside its calls, so
+# every use of it in this process (our rasterizer, ZebrafyPDF, ZebrafyZPL.to_pdf)
+# must hold this lock. Process pool workers each have their own PDFium.
+PDFIUM_LOCK = threading.Lock()
+
+# Payloads below this size are converted in a thread; the process pool's
+# pickling/IPC overhead outweighs the GIL win for tiny images
+PROCESS_POOL_MIN_SIZE = 200 * 1024
+
+# Image formats reported by /analyze_pdf, keyed by PDF stream filter
+# (matching the extensions PyMuPDF's extract_image gives; anything else is png)
+PDF_IMAGE_FORMATS = {
+    "DCTDecode": "jpeg",
+    "JPXDecode": "jpx",
+    "JBIG2Decode": "jb2",
+}
+
+# Bytes at the start of an upload searched for the %PDF- header
+PDF_HEADER_WINDOW = 1024
+
+# PDFs with fewer pages than this are analyzed in threads rather than the process pool
+PROCESS_POOL_MIN_PAGES = 3
+
+# PDFAnalyzer.iter_page_items kinds -> the analyze_page result list they are collected in
+ANALYSIS_RESULT_KEYS = {
+    "text": "text_blocks",
+    "font": "fonts",
+    "image": "images",
+    "barcode": "barcodes",
+    "error": "errors",
+}
+
 # Add near the top with other globals
-TEMP_DIR = "temp"
+# Generated previews; point TEMP_DIR at a tmpfs (e.g. /dev/shm) to keep them off disk
+TEMP_DIR = os.getenv("TEMP_DIR", "temp")
 os.makedirs(TEMP_DIR, exist_ok=True)
 
 # Clean up old temp files periodically
 def cleanup_old_files(directory, max_age_seconds=3600):  # 1 hour
-    current_time = datetime.now().timestamp()
-    for filename in os.listdir(directory):
-        filepath = os.path.join(directory, filename)
-        try:
-            if current_time - os.path.getctime(filepath) > max_age_seconds:
-                os.unlink(filepath)
-        except:
-            pass
+    cutoff = time.time() - max_age_seconds
+    # scandir entries cache their stat results, saving a syscall per file over listdir + getctime
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            try:
+                if entry.stat().st_ctime < cutoff:
+                    os.unlink(entry.path)
+            except OSError:
+                pass
+
+
+@lru_cache(maxsize=1)
+def _iso_timestamp(second: int) -> str:
+    return datetime.fromtimestamp(second, timezone.utc).isoformat(timespec="seconds")
+
+
+def iso_now() -> str:
+    """Current UTC time in ISO 8601, formatted at most once per second"""
+    return _iso_timestamp(int(time.time()))
+
+
+class SizeLimitMiddleware:
+    """Reject requests whose Content-Length exceeds MAX_UPLOAD_SIZE before reading the body"""
+
+    def __init__(self, app, max_size: int = MAX_UPLOAD_SIZE):
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            for name, value in scope["headers"]:
+                if name == b"content-length":
+                    if value.isdigit() and int(value) > self.max_size:
+                        body = b'{"detail":"File too large"}'
+                        await send({
+                            "type": "http.response.start",
+                            "status": 413,
+                            "headers": [
+                                (b"content-type", b"application/json"),
+                                (b"content-length", str(len(body)).encode()),
+                                (b"connection", b"close"),
+                            ],
+                        })
+                        await send({"type": "http.response.body", "body": body})
+                        return
+                    break
+        await self.app(scope, receive, send)
+
+
+async def shrink_mupdf_store(interval: int):
+    """Periodically free half of MuPDF's resource store (cached fonts, images, pages).
+
+    The store only evicts when it reaches its limit, so in a long-running worker
+    it otherwise stays at its high-water mark between requests.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        fitz.TOOLS.store_shrink(50)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run the per-worker background resources for the app's lifetime: the process
+    pool used for CPU-bound ZPL conversions and the MuPDF store shrinker"""
+    # Workers come from a forkserver rather than forking this process, whose
+    # other threads may hold locks (PDFium, MuPDF, logging) at fork time
+    # Each uvicorn worker has its own pool, so the CPUs are split between them
+    app.state.ppool = ProcessPoolExecutor(max_workers=PDF_POOL_WORKERS,
+                                          mp_context=multiprocessing.get_context("forkserver"))
+    store_shrinker = None
+    if MUPDF_STORE_SHRINK_INTERVAL > 0:
+        store_shrinker = asyncio.create_task(shrink_mupdf_store(MUPDF_STORE_SHRINK_INTERVAL))
+    try:
+        yield
+    finally:
+        if store_shrinker is not None:
+            store_shrinker.cancel()
+        app.state.ppool.shutdown()
+
 
 # FastAPI app initialization
 app = FastAPI(
@@ -59,9 +412,14 @@ app = FastAPI(
     version="1.1.0",
     docs_url="/docs",  # Swagger UI
     redoc_url="/redoc",  # ReDoc UI
-    openapi_url="/openapi.json"  # OpenAPI schema
+    openapi_url="/openapi.json",  # OpenAPI schema
+    lifespan=lifespan
 )
 
+# The middleware added last runs first, so CORS wraps the size check and its
+# 413 responses still carry CORS headers for browser clients
+app.add_middleware(SizeLimitMiddleware)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -105,6 +463,8 @@ class HTMLOptions(BaseModel):
     scale: float = Field(1.0, gt=0, description="Scaling factor")
     invert: bool = Field(False, description="Invert black and white")
     dpi: int = Field(203, gt=0, description="DPI for conversion (default: 203 for Zebra printers)")
+    strip_remote_assets: bool = Field(True, description="Remove remote stylesheet links and scripts before rendering")
+    render_dpi: Optional[int] = Field(None, gt=0, description="Rasterize at this lower DPI and upscale to dpi (faster, softer edges; defaults to dpi)")
 
     class Config:
         json_schema_extra = {
@@ -114,7 +474,8 @@ class HTMLOptions(BaseModel):
                 "height": 6.0,
                 "scale": 1.0,
                 "invert": False,
-                "dpi": 203
+                "dpi": 203,
+                "strip_remote_assets": True
             }
         }
 
@@ -140,7 +501,7 @@ class Base64Request(BaseModel):
 
 
 class HTMLRequest(BaseModel):
-    html_content: str = Field(..., description="HTML content to convert")
+    html_content: str = Field(..., description="HTML content to convert (UTF-8)")
     options: Optional[HTMLOptions] = None
 
     class Config:
@@ -153,14 +514,151 @@ class HTMLRequest(BaseModel):
                     "height": 6.0,
                     "scale": 1.0,
                     "invert": False,
+                    "dpi": 203,
+                    "strip_remote_assets": True
+                }
+            }
+        }
+
+
+class HTMLBatchRequest(BaseModel):
+    html_contents: List[str] = Field(..., min_items=1, description="HTML contents to convert, one label each (UTF-8)")
+    options: Optional[HTMLOptions] = None
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "html_contents": [
+                    "<html><body><h1>Label 1</h1></body></html>",
+                    "<html><body><h1>Label 2</h1></body></html>"
+                ],
+                "options": {
+                    "format": "ASCII",
+                    "width": 4.0,
+                    "height": 6.0,
                     "dpi": 203
                 }
             }
         }
 
 
+def threshold_page(image: Image.Image, threshold: int, invert: bool = False) -> Image.Image:
+    """Convert a rendered page to 1-bit black/white the same way ZebrafyImage does without dithering"""
+    light, dark = (0, 255) if invert else (255, 0)
+    return image.convert("L").point(lambda x: light if x > threshold else dark, mode="1")
+
+
+def zpl_crc(data: bytes) -> str:
+    """CRC-16-CCITT of a :B64:/:Z64: payload as 4 hex digits, matching zebrafy's CRC class.
+
+    zebrafy computes the reflected CRC bit by bit in Python; binascii.crc_hqx does
+    the unreflected one in C, so reflect the input bytes and the result around it.
+    """
+    crc = binascii.crc_hqx(data.translate(_BIT_REVERSE), 0xFFFF)
+    crc = int(f"{crc:016b}"[::-1], 2) ^ 0xFFFF
+    return f"{((crc << 8) | (crc >> 8)) & 0xFFFF:04X}"
+
+
+def graphic_field(image: Image.Image, format: str) -> str:
+    """Build a ^GF graphic field for a 1-bit image.
+
+    Output is identical to zebrafy's GraphicField, which encodes (and for Z64
+    compresses) the data twice per field and computes the CRC in pure Python.
+    """
+    image_bytes = image.tobytes()
+    bytes_per_row = (image.width + 7) // 8
+    total_bytes = bytes_per_row * image.height
+    if format == "ASCII":
+        data = image_bytes.hex()
+        return f"^GFA,{len(data)},{total_bytes},{bytes_per_row},{data}^FS"
+    if format in ("B64", "Z64"):
+        payload = base64.b64encode(zlib.compress(image_bytes) if format == "Z64" else image_bytes)
+        # Format the field in one pass instead of first copying the payload into a data string
+        data_length = len(format) + len(payload) + 7  # ":FMT:" + payload + ":" + 4 digit CRC
+        return (f"^GFA,{data_length},{total_bytes},{bytes_per_row},"
+                f":{format}:{payload.decode('ascii')}:{zpl_crc(payload)}^FS")
+    raise ValueError(f'Format must be "ASCII", "B64", or "Z64". {format} was given.')
+
+
+def find_tag(lower: str, name: str, start: int) -> int:
+    """Offset in lower of the next <name tag (not a longer tag name) from start, or -1"""
+    while True:
+        i = lower.find(name, start)
+        if i < 0:
+            return -1
+        after = i + len(name)
+        if after == len(lower) or not (lower[after].isalnum() or lower[after] == "_"):
+            return i
+        start = after
+
+
+def remove_remote_links(html: str) -> str:
+    """Remove <link> tags whose href is remote (http(s) or protocol-relative)"""
+    lower = html.translate(ASCII_LOWERCASE)
+    parts = []
+    pos = 0
+    link = find_tag(lower, "<link", 0)
+    while link >= 0:
+        tag_end = lower.find(">", link)
+        if tag_end < 0:
+            break  # no later link tag is closed either
+        if REMOTE_HREF_RE.search(html, link, tag_end):
+            parts.append(html[pos:link])
+            pos = tag_end + 1
+        link = find_tag(lower, "<link", tag_end + 1)
+    if not parts:
+        return html
+    parts.append(html[pos:])
+    return "".join(parts)
+
+
+def remove_scripts(html: str) -> str:
+    """Remove <script> elements, each up to the next </script> (whitespace allowed before the >)"""
+    lower = html.translate(ASCII_LOWERCASE)
+    parts = []
+    pos = 0
+    script = find_tag(lower, "<script", 0)
+    while script >= 0:
+        opener_end = lower.find(">", script)
+        closer = lower.find("</script", opener_end) if opener_end >= 0 else -1
+        while closer >= 0:
+            tail = closer + len("</script")
+            while tail < len(lower) and lower[tail].isspace():
+                tail += 1
+            if tail < len(lower) and lower[tail] == ">":
+                break
+            closer = lower.find("</script", closer + 1)
+        if closer < 0:
+            break  # no later script is closed either
+        parts.append(html[pos:script])
+        pos = tail + 1
+        script = find_tag(lower, "<script", pos)
+    if not parts:
+        return html
+    parts.append(html[pos:])
+    return "".join(parts)
+
+
+def remove_remote_assets(html: str) -> str:
+    """Remove remote stylesheet links, then scripts, before the HTML reaches WeasyPrint.
+
+    Each pass scans left to right with str.find, looking at every tag once and
+    stopping as soon as no closer remains, so unclosed tags can't make it
+    quadratic the way the equivalent regexes were.
+    """
+    return remove_scripts(remove_remote_links(html))
+
+
 class HTMLToZPL:
-    def __init__(self, html_content, width=4.0, height=6.0, scale=1.0, format="Z64", invert=False, dpi=203):
+    def __init__(self, html_content, width=4.0, height=6.0, scale=1.0, format="Z64", invert=False, dpi=203,
+                 strip_remote_assets=True, render_dpi=None):
+        if strip_remote_assets:
+            html_content = remove_remote_assets(html_content)
+
+        inline_image = INLINE_IMAGE_RE.fullmatch(html_content)
+        self.inline_image = inline_image.group(2) if inline_image else None
+        self.blank = BLANK_HTML_RE.fullmatch(html_content) is not None
+
         self.html_content = html_content
         self.width_inches = width
         self.height_inches = height
@@ -168,6 +666,7 @@ class HTMLToZPL:
         self.format = format
         self.invert = invert
         self.dpi = dpi
+        self.render_dpi = min(render_dpi or dpi, dpi)
 
         self.width_dots = int(self.width_inches * self.dpi)
         self.height_dots = int(self.height_inches * self.dpi)
@@ -175,72 +674,116 @@ class HTMLToZPL:
         self.width_mm = self.width_inches * 25.4
         self.height_mm = self.height_inches * 25.4
 
-        self.html_content = f"""
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <style>
-                @page {{
-                    size: {self.width_mm}mm {self.height_mm}mm;
-                    margin: 0;
-                }}
-                body {{
-                    margin: 0;
-                    padding: 0;
-                    transform: scale({scale});
-                    transform-origin: top left;
-                    width: {self.width_mm}mm;
-                    height: {self.height_mm}mm;
-                    font-family: Arial, sans-serif;
-                }}
-            </style>
-        </head>
-        <body>
-            {html_content}
-        </body>
-        </html>
-        """
+        self.page_css = label_page_css(self.width_mm, self.height_mm, scale)
+        self.html_content = "".join((LABEL_HTML_HEAD, html_content, LABEL_HTML_TAIL))
+        self._cache_key = None
+
+    def _render_bitmap(self, html_digest: bytes) -> Tuple[Image.Image, ...]:
+        """Render the label HTML to thresholded 1-bit page bitmaps, reusing cached renders"""
+        threshold = HTML_THRESHOLD
+        key = (html_digest, self.dpi, self.render_dpi, threshold)
+        pages = _bitmap_cache.get(key)
+        if pages is not None:
+            return pages
+
+        if self.blank:
+            pages = (threshold_page(Image.new("L", (self.width_dots, self.height_dots), 255), threshold),)
+            _bitmap_cache.put(key, pages)
+            return pages
+
+        if self.inline_image:
+            pages = (threshold_page(self._render_inline_image(), threshold),)
+            _bitmap_cache.put(key, pages)
+            return pages
+
+        pages = self.rasterize_pdf(self.render_document().write_pdf())
+        _bitmap_cache.put(key, pages)
+        return pages
+
+    def render_document(self):
+        """Lay out the label HTML with WeasyPrint, downsampling embedded images to the
+        raster DPI so the rasterizer doesn't have to decode oversized images"""
+        return HTML(string=self.html_content, encoding='utf-8').render(
+            stylesheets=[LABEL_BASE_CSS, self.page_css],
+            font_config=FONT_CONFIG,
+            dpi=self.render_dpi
+        )
 
-    def to_zpl(self):
-        try:
-            # Generate a PDF using WeasyPrint
-            with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp_pdf:
-                HTML(string=self.html_content).write_pdf(tmp_pdf.name)
-
-                # Read the PDF file
-                with open(tmp_pdf.name, 'rb') as pdf_file:
-                    pdf_content = pdf_file.read()
-
-                # Convert PDF to ZPL using ZebrafyPDF
-                converter = ZebrafyPDF(
-                    pdf_content,
-                    invert=self.invert,  # Correctly apply the invert option
-                    dither=False,
-                    threshold=128,
-                    dpi=self.dpi,
-                    split_pages=True,
-                    format=self.format
-                )
+    def rasterize_pdf(self, pdf_content: bytes) -> Tuple[Image.Image, ...]:
+        """Rasterize each PDF page the same way ZebrafyPDF does, then apply the threshold"""
+        with PDFIUM_LOCK:
+            pdf = pdfium.PdfDocument(pdf_content)
+            try:
+                return tuple(threshold_page(self._rasterize(page), HTML_THRESHOLD) for page in pdf)
+            finally:
+                pdf.close()
+
+    def _rasterize(self, page) -> Image.Image:
+        """Render a PDF page at render_dpi, upscaled to the size a full dpi render would have"""
+        image = page.render(scale=self.render_dpi / 72).to_pil()
+        if self.render_dpi != self.dpi:
+            width, height = page.get_size()
+            image = image.convert("L").resize(
+                (math.ceil(width * self.dpi / 72), math.ceil(height * self.dpi / 72)),
+                Image.BILINEAR
+            )
+        return image
+
+    def _render_inline_image(self) -> Image.Image:
+        """Lay out a lone data-URI <img> the way WeasyPrint would, without rendering a PDF"""
+        with Image.open(io.BytesIO(base64.b64decode(self.inline_image))) as image:
+            image = image.convert("RGBA")
+
+        # CSS pixels are 1/96 inch; the body is scaled from its top left corner
+        factor = self.dpi / 96 * self.scale
+        image = image.resize(
+            (max(1, round(image.width * factor)), max(1, round(image.height * factor))),
+            Image.BILINEAR
+        )
 
-                zpl_output = converter.to_zpl()
+        page = Image.new("RGB", (self.width_dots, self.height_dots), "white")
+        page.paste(image, (0, 0), image)
+        return page
+
+    def _encode_zpl(self, pages: Tuple[Image.Image, ...]) -> str:
+        """Encode page bitmaps as ZPL, one label per page, with ^PW/^LL/^LS set on the first"""
+        if self.invert:  # Correctly apply the invert option
+            pages = tuple(threshold_page(page, HTML_THRESHOLD, invert=True) for page in pages)
+
+        # Collect the pieces and join once, with the page size header after the first ^XA
+        parts = []
+        for page in pages:
+            parts.append(f"^XA\n^PW{self.width_dots}^LL{self.height_dots}^LS0\n" if not parts else "^XA\n")
+            parts.extend(("^FO0,0", graphic_field(page, self.format), "\n^XZ\n"))
+        return "".join(parts)
+
+    def cache_key(self) -> tuple:
+        """Key identifying this conversion's output: HTML digest, label size, dpis, format and invert"""
+        if self._cache_key is None:
+            # Page size and scale live in the stylesheet, so fold them into the digest
+            digest = blake2b(self.html_content.encode(), digest_size=16)
+            digest.update(f"{self.width_mm}:{self.height_mm}:{self.scale}".encode())
+            self._cache_key = (digest.digest(), self.width_dots, self.height_dots,
+                               self.dpi, self.render_dpi, self.format, self.invert)
+        return self._cache_key
+
+    def to_zpl(self, pages: Optional[Tuple[Image.Image, ...]] = None):
+        try:
+            key = self.cache_key()
+            cached = _zpl_cache.get(key)
+            if cached is not None:
+                return cached
 
-                # Add page width and height ZPL commands
-                zpl_lines = zpl_output.split('\n')
-                if zpl_lines[0] == '^XA':
-                    zpl_lines.insert(1, f'^PW{self.width_dots}^LL{self.height_dots}^LS0')
+            if pages is None:
+                pages = self._render_bitmap(key[0])
+            zpl_output = self._encode_zpl(pages)
 
-                return '\n'.join(zpl_lines)
+            _zpl_cache.put(key, zpl_output)
+            return zpl_output
 
         except Exception as e:
             raise Exception(f"HTML to ZPL conversion failed: {str(e)}")
 
-        finally:
-            # Cleanup temporary file
-            try:
-                os.unlink(tmp_pdf.name)
-            except:
-                pass
-
 
 class ZPLGenerator:
     @staticmethod
@@ -250,6 +793,7 @@ class ZPLGenerator:
 
     @staticmethod
     def generate_text(text: str, x: float, y: float, font_size: float, dpi: int) -> str:
+        """Single text element; PDFAnalyzer.generate_zpl_elements does the same conversion in bulk"""
         # Convert positions from PDF points to ZPL dots
         x_dots = ZPLGenerator.convert_to_zpl_units(x, dpi)
         y_dots = ZPLGenerator.convert_to_zpl_units(y, dpi)
@@ -286,95 +830,116 @@ class ZPLGenerator:
 
 
 class PDFAnalyzer:
-    def __init__(self, pdf_content: bytes):
+    def __init__(self, pdf_content: Optional[bytes] = None, filename: Optional[str] = None):
         self.pdf_content = pdf_content
-        self.pdf = pdfplumber.open(io.BytesIO(pdf_content))
-        self.doc = fitz.open(stream=pdf_content, filetype="pdf")
+        if filename is not None:
+            self.doc = fitz.open(filename, filetype="pdf")
+        else:
+            self.doc = fitz.open(stream=pdf_content, filetype="pdf")
+        self._image_positions: Dict[int, Dict[int, Dict[str, float]]] = {}
+        self._analysis_cache: Dict[int, Dict[str, Any]] = {}
 
     def analyze_page(self, page_num: int = 0) -> Dict[str, Any]:
-        """Analyze a single page of the PDF"""
+        """Analyze a single page of the PDF (cached, so repeat calls for a page are free)"""
+        if page_num in self._analysis_cache:
+            return self._analysis_cache[page_num]
+
         result = {
             'text_blocks': [],
             'images': [],
             'barcodes': [],
-            'fonts': set(),
+            'fonts': [],  # each font once, in order of first use
             'tables': [],
             'errors': []  # Add error tracking
         }
+        for kind, item in self.iter_page_items(page_num):
+            result[ANALYSIS_RESULT_KEYS[kind]].append(item)
+
+        self._analysis_cache[page_num] = result
+        return result
 
+    def iter_page_items(self, page_num: int = 0):
+        """Yield (kind, item) pairs for a page as they are found.
+
+        Kinds are "text", "font" (each font once), "image", "barcode" and "error".
+        Text comes first, so it can be used before the slower barcode decoding ends.
+        """
         try:
             # Get page
-            page = self.pdf.pages[page_num]
-            
-            # Extract text with more detail using pdfplumber
-            text_blocks = page.extract_words(
-                keep_blank_chars=True,
-                x_tolerance=3,
-                y_tolerance=3,
-                extra_attrs=['fontname', 'size']
-            )
+            fitz_page = self.doc[page_num]
 
-            # Process text blocks
-            for block in text_blocks:
-                try:
-                    bbox = tuple(float(v) for v in (block['x0'], block['top'], block['x1'], block['bottom']))
-                    result['text_blocks'].append({
-                        'text': block['text'],
-                        'bbox': bbox,
-                        'font': block.get('fontname', 'default'),
-                        'size': float(block.get('size', 12)),
-                    })
-                    if block.get('fontname'):
-                        result['fonts'].add(block['fontname'])
-                except (KeyError, ValueError) as e:
-                    result['errors'].append(f"Error processing text block: {str(e)}")
+            # Extract text spans (runs of text in one font and size) using PyMuPDF
+            # (TEXTFLAGS_TEXT leaves out image blocks, which would decode every image)
+            fonts = set()
+            for text_block in fitz_page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)["blocks"]:
+                for line in text_block.get("lines", ()):
+                    for span in line["spans"]:
+                        try:
+                            if not span['text'].strip():
+                                continue
+                            bbox = tuple(float(v) for v in span['bbox'])
+                            yield 'text', {
+                                'text': span['text'],
+                                'bbox': bbox,
+                                'font': span.get('font') or 'default',
+                                'size': float(span.get('size', 12)),
+                            }
+                            if span.get('font') and span['font'] not in fonts:
+                                fonts.add(span['font'])
+                                yield 'font', span['font']
+                        except (KeyError, ValueError) as e:
+                            yield 'error', f"Error processing text block: {str(e)}"
 
             # Extract images and analyze for barcodes
-            fitz_page = self.doc[page_num]
             for img_index, img in enumerate(fitz_page.get_images()):
+                xref = img[0]
+                # Let MuPDF decode the image straight into a pixmap, rather than
+                # extracting the encoded stream and decoding it again with PIL
+                pix = fitz.Pixmap(self.doc, xref)
                 try:
-                    xref = img[0]
-                    base_image = self.doc.extract_image(xref)
-                    image_bytes = base_image["image"]
-                    
-                    with Image.open(io.BytesIO(image_bytes)) as image:
-                        # Convert to grayscale for better barcode detection
-                        if image.mode not in ('L', 'RGB'):
-                            image = image.convert('RGB')
-                        
+                    image_size = (pix.width, pix.height)
+                    try:
+                        # Convert to 8-bit grayscale for barcode detection; zbar
+                        # reads the pixmap's samples buffer directly
+                        if pix.alpha:
+                            pix = fitz.Pixmap(pix, 0)
+                        if pix.n != 1:
+                            pix = fitz.Pixmap(fitz.csGRAY, pix)
+
+                        barcodes = pyzbar.decode((pix.samples, pix.width, pix.height))
+                        position = self._get_image_position(fitz_page, xref)
+                    except Exception as e:
+                        yield 'error', f"Error processing barcode: {str(e)}"
+                        continue
+                finally:
+                    # Release the pixel buffer
+                    del pix
+
+                if barcodes and position:
+                    for barcode in barcodes:
                         try:
-                            barcodes = pyzbar.decode(image)
-                            position = self._get_image_position(fitz_page, xref)
-                            
-                            if barcodes and position:
-                                for barcode in barcodes:
-                                    doc_rect = self._calculate_barcode_position(
-                                        barcode, position, image.size)
-                                    if doc_rect:
-                                        result['barcodes'].append({
-                                            'type': barcode.type.decode() if isinstance(barcode.type, bytes) else barcode.type,
-                                            'data': barcode.data.decode('utf-8'),
-                                            'position': doc_rect
-                                        })
-                            else:
-                                if position:
-                                    result['images'].append({
-                                        'index': img_index,
-                                        'size': image.size,
-                                        'format': base_image["ext"],
-                                        'position': position
-                                    })
+                            doc_rect = self._calculate_barcode_position(
+                                barcode, position, image_size)
+                            item = {
+                                'type': barcode.type.decode() if isinstance(barcode.type, bytes) else barcode.type,
+                                'data': barcode.data.decode('utf-8'),
+                                'position': doc_rect
+                            }
                         except Exception as e:
-                            result['errors'].append(f"Error processing barcode: {str(e)}")
-                finally:
-                    # Ensure image is closed
-                    if 'image' in locals():
-                        del image
+                            yield 'error', f"Error processing barcode: {str(e)}"
+                            break
+                        if doc_rect:
+                            yield 'barcode', item
+                elif position:
+                    yield 'image', {
+                        'index': img_index,
+                        'size': image_size,
+                        'format': PDF_IMAGE_FORMATS.get(img[8], 'png'),
+                        'position': position
+                    }
 
         except Exception as e:
-            result['errors'].append(f"Error analyzing page: {str(e)}")
-
-        return result
+            yield 'error', f"Error analyzing page: {str(e)}"
 
     def _calculate_barcode_position(self, barcode, image_pos, image_size):
         """Calculate barcode position in document coordinates"""
@@ -399,25 +964,40 @@ class PDFAnalyzer:
         analysis = self.analyze_page(0)
         
         # Calculate scale factors
-        page = self.pdf.pages[0]
+        page = self.doc[0].rect
         scale_x = width / float(page.width)
         scale_y = height / float(page.height)
         
-        # Process text blocks
-        for block in analysis['text_blocks']:
-            try:
-                x = block['bbox'][0] * scale_x * 72  # Convert to points
-                y = block['bbox'][1] * scale_y * 72
-                if not self._is_point_in_barcode((x, y), analysis.get('barcodes', [])):
-                    zpl_elements.append(ZPLGenerator.generate_text(
-                        block['text'],
-                        x,
-                        y,
-                        float(block['size']) * min(scale_x, scale_y),  # Scale font size
-                        dpi
-                    ))
-            except Exception as e:
-                logger.warning(f"Failed to process text block: {e}")
+        # Process text blocks, skipping any whose origin falls inside a barcode.
+        # All origins are tested against all barcode boxes in one broadcast comparison.
+        text_blocks = analysis['text_blocks']
+        origins = np.array([block['bbox'][:2] for block in text_blocks], dtype=np.float64).reshape(-1, 2)
+        xs = origins[:, 0] * scale_x * 72  # Convert to points
+        ys = origins[:, 1] * scale_y * 72
+        boxes = np.array([
+            [pos['x0'], pos['y0'], pos['x1'], pos['y1']]
+            for pos in (barcode.get('position') for barcode in analysis.get('barcodes', []))
+            if pos
+        ], dtype=np.float64).reshape(-1, 4)
+        in_barcode = (
+            (xs[:, None] >= boxes[:, 0]) & (xs[:, None] <= boxes[:, 2]) &
+            (ys[:, None] >= boxes[:, 1]) & (ys[:, None] <= boxes[:, 3])
+        ).any(axis=1)
+
+        # Convert the remaining blocks' positions and font sizes to dots in bulk,
+        # with the same arithmetic as ZPLGenerator.generate_text
+        keep = np.flatnonzero(~in_barcode)
+        x_dots = (xs[keep] / 72.0 * dpi).astype(np.int64)
+        y_dots = (ys[keep] / 72.0 * dpi).astype(np.int64)
+        font_sizes = np.array([text_blocks[i]['size'] for i in keep], dtype=np.float64) * min(scale_x, scale_y)
+        font_heights = np.clip((font_sizes * 1.2).astype(np.int64), 9, 120)
+        font_widths = (font_heights * 0.8).astype(np.int64)
+        zpl_elements.extend(
+            f"^FO{x},{y}^A0,{font_height},{font_width}^FD{text_blocks[i]['text']}^FS"
+            for i, x, y, font_height, font_width in zip(
+                keep.tolist(), x_dots.tolist(), y_dots.tolist(), font_heights.tolist(), font_widths.tolist()
+            )
+        )
 
         # Process barcodes
         for barcode in analysis.get('barcodes', []):
@@ -435,7 +1015,7 @@ class PDFAnalyzer:
                     dpi
                 ))
             except Exception as e:
-                logger.warning(f"Failed to process barcode: {e}")
+                logger.warning("Failed to process barcode: %s", e)
 
         # Process remaining images
         for img in analysis['images']:
@@ -444,55 +1024,291 @@ class PDFAnalyzer:
 
         return '\n'.join(zpl_elements), embedded_images
 
-    def _is_point_in_barcode(self, point, barcodes):
-        """Check if a point falls within any barcode area"""
-        if not barcodes:
-            return False
-            
-        x, y = point
-        for barcode in barcodes:
-            pos = barcode.get('position', {})
-            if not pos:
-                continue
-                
-            x0 = pos.get('x0', 0)
-            x1 = pos.get('x1', 0)
-            y0 = pos.get('y0', 0)
-            y1 = pos.get('y1', 0)
-            
-            if (x0 <= x <= x1 and y0 <= y <= y1):
-                return True
-        return False
-
     def _get_image_position(self, page, xref):
         """Get the position of an image on the page"""
-        for block in page.get_text("dict", flags=11)["blocks"]:
-            if "image" in block and block["image"]["xref"] == xref:
-                return {
-                    'x0': block['bbox'][0],
-                    'y0': block['bbox'][1],
-                    'x1': block['bbox'][2],
-                    'y1': block['bbox'][3]
-                }
-        return None
+        positions = self._image_positions.get(page.number)
+        if positions is None:
+            # Index every image on the page once, instead of rescanning the page per image
+            positions = {}
+            for info in page.get_image_info(xrefs=True):
+                positions.setdefault(info['xref'], {
+                    'x0': info['bbox'][0],
+                    'y0': info['bbox'][1],
+                    'x1': info['bbox'][2],
+                    'y1': info['bbox'][3]
+                })
+            self._image_positions[page.number] = positions
+        return positions.get(xref)
 
     def close(self):
         """Close all open PDF handlers"""
-        self.pdf.close()
+        self._image_positions.clear()
+        self._analysis_cache.clear()
         self.doc.close()
 
 
-def json_serial(obj):
-    """JSON serializer for objects not serializable by default json code"""
-    if isinstance(obj, Decimal):
-        return float(obj)
-    if isinstance(obj, set):
-        return list(obj)
-    if isinstance(obj, bytes):
-        return base64.b64encode(obj).decode('utf-8')
-    if hasattr(obj, '__dict__'):
-        return obj.__dict__
-    raise TypeError(f"Type {type(obj)} not serializable")
+def _analyze_page_worker(pdf_content: Optional[bytes], page_num: int, filename: Optional[str] = None) -> Dict[str, Any]:
+    """Analyze one page with its own PDFAnalyzer (top-level so it can be pickled to the process pool)"""
+    analyzer = PDFAnalyzer(pdf_content, filename=filename)
+    try:
+        return analyzer.analyze_page(page_num)
+    finally:
+        analyzer.close()
+
+
+def _run_zpl(file_type: str, file_content: bytes, options: Dict[str, Any]) -> str:
+    """Convert PDF or image bytes to ZPL (top-level so it can be pickled to the process pool)"""
+    if file_type == "pdf":
+        # Small PDFs are converted in a thread, next to other PDFium users
+        with PDFIUM_LOCK:
+            return ZebrafyPDF(file_content, **options).to_zpl()
+    return ZebrafyImage(file_content, **options).to_zpl()
+
+
+def zpl_to_pdf(zpl: str) -> bytes:
+    """Render ZPL to a preview PDF with ZebrafyZPL (which writes the PDF with PDFium)"""
+    converter = ZebrafyZPL(zpl)
+    with PDFIUM_LOCK:
+        return converter.to_pdf()
+
+
+def _split_pdf_pages(pdf_content: bytes) -> List[bytes]:
+    """Split a multi-page PDF into single-page PDFs; returns an empty list for single-page PDFs"""
+    with fitz.open(stream=pdf_content, filetype="pdf") as doc:
+        if doc.page_count < 2:
+            return []
+        pages = []
+        for page_num in range(doc.page_count):
+            with fitz.open() as page_doc:
+                page_doc.insert_pdf(doc, from_page=page_num, to_page=page_num)
+                pages.append(page_doc.tobytes())
+        return pages
+
+
+async def run_zpl_conversion(file_type: str, file_content: bytes, options: Dict[str, Any]) -> str:
+    """Run a Zebrafy conversion off the event loop.
+
+    Multi-page PDFs are converted one page per process pool task and reassembled
+    the way ZebrafyPDF joins its pages, so the output is the same as a serial run.
+    """
+    loop = asyncio.get_running_loop()
+
+    if file_type == "pdf":
+        pages = await loop.run_in_executor(None, _split_pdf_pages, file_content)
+        if pages:
+            page_options = {**options, "complete_zpl": False}
+            fields = await asyncio.gather(*(
+                loop.run_in_executor(app.state.ppool, _run_zpl, "pdf", page, page_options)
+                for page in pages
+            ))
+            if options.get("complete_zpl") is False:
+                return "".join(fields)
+            if options.get("split_pages"):
+                return "".join("^XA\n" + field + "^XZ\n" for field in fields)
+            return "^XA\n" + "".join(fields) + "^XZ\n"
+
+    executor = None if len(file_content) < PROCESS_POOL_MIN_SIZE else app.state.ppool
+    return await loop.run_in_executor(executor, _run_zpl, file_type, file_content, options)
+
+
+def build_html_converter(html_content: str, options: Optional[HTMLOptions]) -> HTMLToZPL:
+    """Create an HTMLToZPL converter from request options"""
+    options = options or HTMLOptions()
+    return HTMLToZPL(
+        html_content,
+        width=options.width,
+        height=options.height,
+        scale=options.scale,
+        format=options.format,
+        invert=options.invert,
+        dpi=options.dpi,
+        strip_remote_assets=options.strip_remote_assets,
+        render_dpi=options.render_dpi
+    )
+
+
+def keyed_html_converter(html_content: str, options: Optional[HTMLOptions]) -> Tuple[tuple, HTMLToZPL]:
+    """Build a converter and its cache key. Both scan or hash the whole HTML, so this
+    runs in a worker thread rather than on the event loop."""
+    converter = build_html_converter(html_content, options)
+    return converter.cache_key(), converter
+
+
+def html_batch_to_zpl(html_contents: List[str], options: Optional[HTMLOptions]) -> List[str]:
+    """Convert several labels, writing and rasterizing all uncached ones as a single PDF.
+
+    Each label is still laid out on its own, so its page count (and the pages
+    belonging to it) stay known; only PDF serialization and rasterization are shared.
+    Runs in a worker thread, converters included, since building them scans the HTML.
+    """
+    converters = [build_html_converter(html, options) for html in html_contents]
+    zpl = [_zpl_cache.get(converter.cache_key()) for converter in converters]
+    pending = [i for i, converter in enumerate(converters)
+               if zpl[i] is None and not (converter.inline_image or converter.blank)]
+
+    if pending:
+        documents = [converters[i].render_document() for i in pending]
+        combined = documents[0].copy([page for document in documents for page in document.pages])
+        # rasterize_pdf holds PDFIUM_LOCK for the whole combined PDF, so a batch never
+        # renders alongside /convert/html or thread-pool /convert/raw requests
+        pages = converters[pending[0]].rasterize_pdf(combined.write_pdf())
+
+        start = 0
+        for i, document in zip(pending, documents):
+            end = start + len(document.pages)
+            zpl[i] = converters[i].to_zpl(pages[start:end])
+            start = end
+
+    # Cached, blank and inline image labels take the regular single-label path
+    return [output if output is not None else converter.to_zpl() for output, converter in zip(zpl, converters)]
+
+
+async def analyze_pdf_page(pdf_content: Optional[bytes], page_num: int, filename: Optional[str] = None) -> Dict[str, Any]:
+    """Analyze one PDF page off the event loop.
+
+    Text walking and barcode decoding hold the GIL, so PDFs opened from disk and
+    large in-memory ones go to the process pool; small ones run in a thread.
+    """
+    loop = asyncio.get_running_loop()
+    if filename is None and len(pdf_content) < PROCESS_POOL_MIN_SIZE:
+        executor = None
+    else:
+        executor = app.state.ppool
+    return await loop.run_in_executor(executor, _analyze_page_worker, pdf_content, page_num, filename)
+
+
+async def analyze_pdf_pages(pdf_content: Optional[bytes], page_count: int,
+                            filename: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Analyze every page of a PDF off the event loop, one task per page.
+
+    Pages are independent, so multi-page PDFs are spread across the process pool;
+    one or two pages run in threads, where there is too little work to pay for IPC.
+    With filename set, each worker opens the file itself instead of receiving a copy.
+    """
+    loop = asyncio.get_running_loop()
+    executor = None if page_count < PROCESS_POOL_MIN_PAGES else app.state.ppool
+    return await asyncio.gather(*(
+        loop.run_in_executor(executor, _analyze_page_worker, pdf_content, page_num, filename)
+        for page_num in range(page_count)
+    ))
+
+
+async def render_html_zpl(request: HTMLRequest) -> str:
+    """Convert an HTMLRequest to ZPL off the event loop"""
+    loop = asyncio.get_running_loop()
+    key, converter = await loop.run_in_executor(None, keyed_html_converter, request.html_content, request.options)
+
+    # Join an identical conversion that is already running
+    future = _inflight_html.get(key)
+    if future is None:
+        # Render in a worker thread so WeasyPrint doesn't block the event loop
+        future = loop.run_in_executor(None, converter.to_zpl)
+        _inflight_html[key] = future
+        future.add_done_callback(lambda _: _inflight_html.pop(key, None))
+
+    # Shield the shared render so one client disconnecting doesn't cancel it for the others
+    return await asyncio.shield(future)
+
+
+async def read_upload(file: UploadFile) -> bytes:
+    """Read a multipart upload, refusing it before it is copied into memory if it is too large.
+
+    Starlette streams each part into a spooled temporary file while parsing, so the
+    size is known up front. This also catches chunked requests, which carry no
+    Content-Length for SizeLimitMiddleware to check.
+    """
+    check_upload_size(file)
+    return await file.read()
+
+
+async def is_pdf_upload(file: UploadFile) -> bool:
+    """Whether an upload starts like a PDF, leaving it rewound.
+
+    Sniffs the %PDF- header instead of trusting the client's Content-Type; like
+    PDF readers, it accepts the header anywhere in the first 1KB.
+    """
+    head = await file.read(PDF_HEADER_WINDOW)
+    await file.seek(0)
+    return b"%PDF-" in head
+
+
+def check_upload_size(file: UploadFile):
+    """Raise 413 if a multipart upload is larger than MAX_UPLOAD_SIZE"""
+    if file.size is not None and file.size > MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=413, detail="File too large")
+
+
+def spooled_upload_path(file: UploadFile) -> Optional[str]:
+    """Path of an upload Starlette has spooled to disk, or None while it is still in memory.
+
+    The spool is an anonymous temporary file, which Linux exposes under /proc;
+    MuPDF can open that path (also from a process pool worker) and read just the
+    parts of the PDF it needs.
+    """
+    if not getattr(file.file, "_rolled", False):
+        return None
+    path = f"/proc/{os.getpid()}/fd/{file.file.fileno()}"
+    return path if os.path.exists(path) else None
+
+
+async def content_digest(content: bytes):
+    """blake2b hash object of content; large buffers are hashed in a worker thread,
+    since hashlib releases the GIL while it hashes"""
+    if len(content) < PROCESS_POOL_MIN_SIZE:
+        return blake2b(content, digest_size=16)
+    return await asyncio.get_running_loop().run_in_executor(
+        None, lambda: blake2b(content, digest_size=16))
+
+
+async def upload_digest(file: UploadFile) -> bytes:
+    """Hash an upload in chunks without loading it into memory, leaving it rewound"""
+    digest = blake2b(digest_size=16)
+    await file.seek(0)
+    while chunk := await file.read(ZPL_STREAM_CHUNK_SIZE):
+        digest.update(chunk)
+    await file.seek(0)
+    return digest.digest()
+
+
+def iter_zpl_chunks(zpl: str):
+    """Yield ZPL as encoded slices so the full output is never copied into one bytes object"""
+    for start in range(0, len(zpl), ZPL_STREAM_CHUNK_SIZE):
+        yield zpl[start:start + ZPL_STREAM_CHUNK_SIZE].encode()
+
+
+def analysis_response(result: Dict[str, Any], columnar: bool = False) -> Dict[str, Any]:
+    """Shape an analyze_page result for the response: as is, or with columnar set, text
+    blocks as parallel lists instead of one dict per span (no repeated keys)."""
+    if not columnar:
+        return result
+    blocks = result['text_blocks']
+    return {**result, 'text_blocks': {
+        'text': [block['text'] for block in blocks],
+        'bbox': [block['bbox'] for block in blocks],
+        'font': [block['font'] for block in blocks],
+        'size': [block['size'] for block in blocks],
+    }}
+
+
+def iter_analysis_ndjson(analyzer: "PDFAnalyzer", page_num: int):
+    """Yield one NDJSON line per analysis item"""
+    for kind, item in analyzer.iter_page_items(page_num):
+        yield orjson.dumps({"kind": kind, "value": item}) + b"\n"
+
+
+async def stream_analysis_ndjson(analyzer: "PDFAnalyzer", page_num: int):
+    """Stream iter_analysis_ndjson under a pdf_gate slot, closing the analyzer when done.
+
+    The slot is held for the whole stream, so streamed analyses count against
+    PDF_CONCURRENCY like /analyze_pdf does. The plain generator is driven in a
+    worker thread, keeping MuPDF and zbar off the event loop.
+    """
+    try:
+        async with pdf_gate.slot():
+            async for line in iterate_in_threadpool(iter_analysis_ndjson(analyzer, page_num)):
+                yield line
+    finally:
+        analyzer.close()
 
 
 @app.get("/", summary="Main Page", description="Serve the main page with file upload form")
@@ -522,8 +1338,8 @@ async def main_page(request: Request):
           })
 async def upload_pdf(
     file: UploadFile = File(...),
-    width: float = Form(None),
-    height: float = Form(None),
+    width: float = Form(..., gt=0),
+    height: float = Form(..., gt=0),
     dpi: int = Form(203),
     format: str = Form("ASCII"),
     invert: bool = Form(False),
@@ -533,103 +1349,126 @@ async def upload_pdf(
 ):
     """Handle PDF file upload and convert to ZPL"""
     try:
-        if file.content_type != "application/pdf":
+        if not await is_pdf_upload(file):
             raise HTTPException(status_code=400, detail="Invalid file type. Only PDF files are allowed.")
 
-        # Read file content
-        file_content = await file.read()
+        # Uploads spooled to disk are opened from there; smaller ones are read into memory
+        check_upload_size(file)
+        path = spooled_upload_path(file)
+        file_content = None if path is not None else await read_upload(file)
 
-        # Add analysis before conversion
-        analyzer = PDFAnalyzer(file_content)
-        try:
-            analysis = analyzer.analyze_page(0)
+        # Label size in printer dots, for the ^PW/^LL commands and the image conversion
+        width_dots = int(width * dpi)
+        height_dots = int(height * dpi)
+
+        async with pdf_gate.slot():
+            # Add analysis before conversion
+            analyzer = PDFAnalyzer(file_content, filename=path)
+            try:
+                analysis = analyzer.analyze_page(0)
             
-            # Generate ZPL elements and get list of images to process
-            zpl_elements, embedded_images = analyzer.generate_zpl_elements(dpi, width, height)
+                # Generate ZPL elements and get list of images to process
+                zpl_elements, embedded_images = analyzer.generate_zpl_elements(dpi, width, height)
             
-            # Process only the embedded images
-            if embedded_images:
-                # Create a new PDF with only the embedded images
-                image_pdf = await create_image_only_pdf(file_content, embedded_images, width, height, dpi)
+                # Process only the embedded images
+                if embedded_images:
+                    # Create a new PDF with only the embedded images
+                    # Reuse the analyzer's open document rather than parsing the upload again
+                    image_pdf = await create_image_only_pdf(file_content, embedded_images, width, height, dpi,
+                                                            doc=analyzer.doc)
                 
-                # Convert image content to ZPL
-                converter = ZebrafyPDF(
-                    image_pdf,
-                    invert=invert,
-                    dither=dither,
-                    threshold=128,
-                    dpi=dpi,
-                    split_pages=split_pages,
-                    format=format,
-                    width=width_dots,
-                    height=height_dots,
-                    pos_x=0,
-                    pos_y=0,
-                    rotation=0,
-                    complete_zpl=True,
-                    string_line_break=None
-                )
-                base_zpl = converter.to_zpl()
-            else:
-                base_zpl = "^XA^FS"  # Empty label if no images
-
-            # Combine elements
-            zpl_lines = base_zpl.split('\n')
-            if zpl_lines[0] == '^XA':
-                zpl_lines.insert(1, f'^PW{width_dots}')
-                zpl_lines.insert(2, f'^LL{height_dots}')
-                zpl_lines.insert(3, '^LS0')
-                # Add text and barcode elements after dimensions but before image
-                for element in zpl_elements.split('\n'):
-                    zpl_lines.insert(4, element)
-
-            final_zpl = '\n'.join(zpl_lines)
-
-            # Save scaled PDF for preview
-            preview_path = f"static/preview_{datetime.now().timestamp()}.pdf"
-            with open(preview_path, "wb") as f:
-                f.write(scaled_content)
-
-            # Generate ZPL preview PDF
-            zpl_preview_path = f"temp/zpl_preview_{datetime.now().timestamp()}.pdf"
-            zpl_converter = ZebrafyZPL(final_zpl)
-            zpl_preview_data = zpl_converter.to_pdf()
-            with open(zpl_preview_path, "wb") as f:
-                f.write(zpl_preview_data)
+                    # Convert image content to ZPL
+                    base_zpl = await run_zpl_conversion("pdf", image_pdf, {
+                        "invert": invert,
+                        "dither": dither,
+                        "threshold": 128,
+                        "dpi": dpi,
+                        "split_pages": split_pages,
+                        "format": format,
+                        "width": width_dots,
+                        "height": height_dots,
+                        "pos_x": 0,
+                        "pos_y": 0,
+                        "rotation": 0,
+                        "complete_zpl": True,
+                        "string_line_break": None
+                    })
+                else:
+                    base_zpl = "^XA^FS"  # Empty label if no images
 
-            return JSONResponse(
-                content=json.loads(
-                    json.dumps({
+                # Combine elements
+                zpl_lines = base_zpl.split('\n')
+                if zpl_lines[0] == '^XA':
+                    zpl_lines.insert(1, f'^PW{width_dots}')
+                    zpl_lines.insert(2, f'^LL{height_dots}')
+                    zpl_lines.insert(3, '^LS0')
+                    # Add text and barcode elements after dimensions but before image
+                    for element in zpl_elements.split('\n'):
+                        zpl_lines.insert(4, element)
+
+                final_zpl = '\n'.join(zpl_lines)
+
+                # Save scaled PDF for preview
+                scaled_content = await scale_pdf(file_content, width, height, dpi, scaling == "fit",
+                                                 doc=analyzer.doc)
+                preview_path = f"static/preview_{time.time()}.pdf"
+                with open(preview_path, "wb") as f:
+                    f.write(scaled_content)
+
+                # Generate ZPL preview PDF. Files are named by a hash of the ZPL, so a
+                # preview for identical ZPL (e.g. a retried upload) is reused as is.
+                zpl_hash = blake2b(final_zpl.encode(), digest_size=16).hexdigest()
+                zpl_preview_name = f"zpl_preview_{zpl_hash}.pdf"
+                zpl_preview_path = os.path.join(TEMP_DIR, zpl_preview_name)
+                if not os.path.exists(zpl_preview_path):
+                    # In a worker thread: waiting for PDFIUM_LOCK must not block the event loop
+                    zpl_preview_data = await asyncio.get_running_loop().run_in_executor(
+                        None, zpl_to_pdf, final_zpl)
+                    # Write then rename, so concurrent uploads never serve a half-written file
+                    partial_path = f"{zpl_preview_path}.{os.getpid()}.{threading.get_ident()}"
+                    with open(partial_path, "wb") as f:
+                        f.write(zpl_preview_data)
+                    os.replace(partial_path, zpl_preview_path)
+                else:
+                    # Touch the reused file so cleanup_old_files doesn't remove it from under the client
+                    os.utime(zpl_preview_path)
+
+                # Serialize once with orjson and send the bytes as is
+                return Response(
+                    content=orjson.dumps({
                         "status": "success", 
                         "zpl_content": final_zpl,
                         "preview_url": f"/{preview_path}",  # Add preview URL to response
-                        "zpl_preview_url": f"/{zpl_preview_path}",  # Add ZPL preview URL to response
+                        "zpl_preview_url": f"/temp/{zpl_preview_name}",  # Add ZPL preview URL to response
                         "analysis": analysis,  # Include analysis in response
-                        "timestamp": datetime.now().isoformat()
-                    }, default=json_serial)
+                        "timestamp": iso_now()
+                    }),
+                    media_type="application/json"
                 )
-            )
-        finally:
-            analyzer.close()
+            finally:
+                analyzer.close()
 
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"PDF conversion failed: {e}")
+        logger.error("PDF conversion failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
-async def scale_pdf(content: bytes, width: float, height: float, dpi: int, maintain_ratio: bool = True):
-    """Pre-scale PDF content to match desired dimensions using PyMuPDF"""
+async def scale_pdf(content: Optional[bytes], width: float, height: float, dpi: int, maintain_ratio: bool = True,
+                    doc: Optional[fitz.Document] = None):
+    """Pre-scale PDF content to match desired dimensions using PyMuPDF.
+
+    Pass doc when the caller already has content open, to skip parsing it again;
+    content may then be None.
+    """
     try:
         if not width or not height:
-            return content
+            return content if content is not None else doc.tobytes()
 
         # Load PDF from bytes
-        doc = fitz.open(stream=content, filetype="pdf")
-        page = doc[0]  # Get first page
-        
-        # Get original dimensions
-        orig_width = page.rect.width
-        orig_height = page.rect.height
+        if doc is None:
+            doc = fitz.open(stream=content, filetype="pdf")
         
         # Calculate target dimensions in points (72 points per inch)
         target_width = width * 72
@@ -639,35 +1478,111 @@ async def scale_pdf(content: bytes, width: float, height: float, dpi: int, maint
         new_doc = fitz.open()
         new_page = new_doc.new_page(width=target_width, height=target_height)
         
-        if maintain_ratio:
-            # Calculate scaling factors
-            scale_x = target_width / orig_width
-            scale_y = target_height / orig_height
-            scale = min(scale_x, scale_y)
-            
-            # Calculate centering offsets
-            x_offset = (target_width - (orig_width * scale)) / 2
-            y_offset = (target_height - (orig_height * scale)) / 2
-            
-            # Create transform matrix with scaling and translation
-            matrix = fitz.Matrix(scale, scale).pretranslate(x_offset, y_offset)
-        else:
-            # Non-uniform scaling
-            matrix = fitz.Matrix(target_width/orig_width, target_height/orig_height)
-        
-        # Copy content with transformation
-        new_page.show_pdf_page(new_page.rect, doc, 0, transform=matrix)
+        # Copy content scaled to the page; keeping the aspect ratio centers it,
+        # otherwise it is stretched to fill the page
+        new_page.show_pdf_page(new_page.rect, doc, 0, keep_proportion=maintain_ratio)
         
         # Get the result as bytes
         return new_doc.tobytes()
 
     except Exception as e:
-        logger.error(f"PDF scaling failed: {str(e)}")
+        logger.error("PDF scaling failed: %s", e)
         # Return original content if scaling fails
-        return content
+        return content if content is not None else doc.tobytes()
+
+
+@lru_cache(maxsize=16)
+def blank_pdf(width: float, height: float) -> bytes:
+    """A one-page empty PDF of the given size in points (label sizes repeat, so cached)"""
+    with fitz.open() as doc:
+        doc.new_page(width=width, height=height)
+        return doc.tobytes()
+
+
+def place_page_copies(page: fitz.Page, doc: fitz.Document, rects: List[fitz.Rect]):
+    """Draw page 0 of doc into every rect on page, as repeated show_pdf_page calls would.
+
+    show_pdf_page rescans the target page's resources on each call, which is
+    quadratic in the number of rects. The source page is grafted once by the first
+    call; the other copies are drawn from that same form XObject by a single
+    appended content stream with the matrix and clip show_pdf_page would use.
+
+    Every copy, the first included, is also clipped to its target rect: the clip to
+    the source's crop box alone can leave a row of pixels drawn just outside it.
+    Rasterizers still fill any pixel the clip touches, so rects should lie on the
+    pixel grid they will be rendered at.
+    """
+    form_xref = page.show_pdf_page(rects[0], doc, 0)
+
+    def clip(rect: fitz.Rect) -> str:
+        # Inset a hair, so float error in a rect on pixel edges can't round it out a pixel
+        rect = rect + (1e-3, 1e-3, -1e-3, -1e-3)
+        return f"{rect.x0:.6f} {rect.y0:.6f} {rect.width:.6f} {rect.height:.6f} re W n"
+
+    new_doc = page.parent
+    src_page = doc[0]
+    src = src_page.rect * ~src_page.transformation_matrix
+    to_pdf = ~page.transformation_matrix
+    # The first copy is the only thing drawn on the fresh page so far
+    contents = page.get_contents()[-1]
+    ops = [f"q {clip(rects[0] * to_pdf)}", new_doc.xref_stream(contents).decode(), "Q"]
+    for rect in rects[1:]:
+        target = rect * to_pdf
+        # Keep the aspect ratio and center in the target, like show_pdf_page
+        scale = min(target.width / src.width, target.height / src.height)
+        m = (fitz.Matrix(1, 0, 0, 1, -(src.x0 + src.x1) / 2, -(src.y0 + src.y1) / 2)
+             * fitz.Matrix(scale, scale)
+             * fitz.Matrix(1, 0, 0, 1, (target.x0 + target.x1) / 2, (target.y0 + target.y1) / 2))
+        ops.append(f"q {clip(target)} {m.a:g} {m.b:g} {m.c:g} {m.d:g} {m.e:g} {m.f:g} cm "
+                   f"{src.x0:g} {src.y0:g} {src.width:g} {src.height:g} re W n /fzPage Do Q")
+
+    if len(rects) > 1:
+        kind, value = new_doc.xref_get_key(page.xref, "Resources")
+        if kind == "xref":
+            new_doc.xref_set_key(int(value.split()[0]), "XObject/fzPage", f"{form_xref} 0 R")
+        else:
+            new_doc.xref_set_key(page.xref, "Resources/XObject/fzPage", f"{form_xref} 0 R")
+    new_doc.update_stream(contents, " ".join(ops).encode())
+
+
+async def create_image_only_pdf(content: Optional[bytes], images: list, width: float, height: float, dpi: int,
+                                doc: Optional[fitz.Document] = None) -> bytes:
+    """Create a new PDF containing only the specified images.
+
+    Pass doc when the caller already has content open, to skip parsing it again.
+    """
+    # Resolve every target rectangle up front, snapped to the pixel grid of the dpi
+    # the result is rasterized at, so no copy shades a pixel outside its rect.
+    # Images that snap to nothing would not have shown up anyway.
+    px = 72 / dpi
+    rects = [
+        rect
+        for img in images
+        if (pos := img.get('position'))
+        and not (rect := fitz.Rect(round(pos['x0'] / px) * px, round(pos['y0'] / px) * px,
+                                   round(pos['x1'] / px) * px, round(pos['y1'] / px) * px)).is_empty
+    ]
+    if not rects:
+        # Nothing to place, so the source never needs to be opened
+        return blank_pdf(width*72, height*72)
+
+    owns_doc = doc is None
+    if owns_doc:
+        doc = fitz.open(stream=content, filetype="pdf")
+    try:
+        # The result is only rasterized again, so it is written uncompressed and
+        # MuPDF's copy is released as soon as the bytes exist
+        with fitz.open() as new_doc:
+            page = new_doc.new_page(width=width*72, height=height*72)
+            place_page_copies(page, doc, rects)
+            return new_doc.tobytes()
+    finally:
+        if owns_doc:
+            doc.close()
 
 
 @app.post("/convert/html", summary="Convert HTML to ZPL", description="Convert HTML content to ZPL",
+          response_class=ORJSONResponse,
           responses={
               200: {
                   "description": "Successful conversion",
@@ -681,33 +1596,165 @@ async def scale_pdf(content: bytes, width: float, height: float, dpi: int, maint
                       }
                   }
               },
+              400: {"description": "Empty HTML content"},
               500: {"description": "Conversion failed"}
           })
 async def convert_html(request: HTMLRequest):
     """Convert HTML content to ZPL"""
     logger.info("Received request to convert HTML to ZPL.")
+    if not request.html_content.strip():
+        raise HTTPException(status_code=400, detail="html_content is empty")
+
     try:
-        options = request.options or HTMLOptions()
-
-        converter = HTMLToZPL(
-            request.html_content,
-            width=options.width,
-            height=options.height,
-            scale=options.scale,
-            format=options.format,
-            invert=options.invert,
-            dpi=options.dpi
-        )
+        zpl_output = await render_html_zpl(request)
+
+        return {
+            "status": "success",
+            "zpl_content": zpl_output,
+            "timestamp": iso_now()
+        }
+    except Exception as e:
+        logger.error("HTML conversion failed: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/convert/html/zpl", summary="Convert HTML to raw ZPL",
+          description="Convert HTML content to ZPL and stream it back as plain text, without a JSON envelope",
+          response_class=StreamingResponse,
+          responses={
+              200: {
+                  "description": "Successful conversion",
+                  "content": {"text/plain": {"example": "^XA\n^PW812^LL1218^LS0\n^FO0,0^GFA,...^FS\n^XZ\n"}}
+              },
+              400: {"description": "Empty HTML content"},
+              500: {"description": "Conversion failed"}
+          })
+async def convert_html_zpl(request: HTMLRequest):
+    """Convert HTML content to ZPL, streamed as plain text"""
+    logger.info("Received request to convert HTML to raw ZPL.")
+    if not request.html_content.strip():
+        raise HTTPException(status_code=400, detail="html_content is empty")
+
+    try:
+        zpl_output = await render_html_zpl(request)
+        return StreamingResponse(iter_zpl_chunks(zpl_output), media_type="text/plain")
+    except Exception as e:
+        logger.error("HTML conversion failed: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/convert/html/batch", summary="Convert a batch of HTML labels to ZPL",
+          description="Convert several HTML labels with the same options in one request. "
+                      "zpl_contents[i] is the ZPL for html_contents[i].",
+          response_class=ORJSONResponse,
+          responses={
+              200: {
+                  "description": "Successful conversion",
+                  "content": {
+                      "application/json": {
+                          "example": {
+                              "status": "success",
+                              "zpl_contents": [
+                                  "^XA^FO50,50^ADN,36,20^FDLabel 1^FS^XZ",
+                                  "^XA^FO50,50^ADN,36,20^FDLabel 2^FS^XZ"
+                              ],
+                              "timestamp": "2023-10-01T12:00:00Z"
+                          }
+                      }
+                  }
+              },
+              400: {"description": "Empty HTML content"},
+              500: {"description": "Conversion failed"}
+          })
+async def convert_html_batch(request: HTMLBatchRequest):
+    """Convert a batch of HTML labels to ZPL"""
+    logger.info("Received request to convert %d HTML labels to ZPL.", len(request.html_contents))
+    for index, html in enumerate(request.html_contents):
+        if not html.strip():
+            raise HTTPException(status_code=400, detail=f"html_contents[{index}] is empty")
+
+    try:
+        # Build and render in a worker thread so neither blocks the event loop
+        loop = asyncio.get_running_loop()
+        zpl_outputs = await loop.run_in_executor(None, html_batch_to_zpl, request.html_contents, request.options)
+
+        return {
+            "status": "success",
+            "zpl_contents": zpl_outputs,
+            "timestamp": iso_now()
+        }
+    except Exception as e:
+        logger.error("HTML batch conversion failed: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/convert/raw", summary="Convert raw file to ZPL",
+          description="Convert a PDF, PNG or JPEG sent as the raw request body (no multipart or base64 encoding). "
+                      "Set Content-Type to application/pdf, image/png or image/jpeg.",
+          response_class=ORJSONResponse,
+          responses={
+              200: {
+                  "description": "Successful conversion",
+                  "content": {
+                      "application/json": {
+                          "example": {
+                              "status": "success",
+                              "zpl_content": "^XA^FO50,50^ADN,36,20^FDZPL encoded image^FS^XZ",
+                              "timestamp": "2023-10-01T12:00:00Z"
+                          }
+                      }
+                  }
+              },
+              400: {"description": "Invalid file type"},
+              413: {"description": "File too large"},
+              500: {"description": "Conversion failed"}
+          })
+async def convert_raw(
+    request: Request,
+    format: str = Query("Z64", description="ZPL format type (ASCII, B64, or Z64)"),
+    invert: bool = Query(True, description="Invert black and white"),
+    dither: bool = Query(False, description="Use dithering"),
+    threshold: int = Query(128, ge=0, le=255, description="Black pixel threshold (0-255)"),
+    dpi: int = Query(72, gt=0, description="PDF DPI (PDF only)"),
+    split_pages: bool = Query(True, description="Split PDF pages (PDF only)")
+):
+    """Convert a raw PDF or image request body to ZPL"""
+    try:
+        content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+        file_type = RAW_CONTENT_TYPES.get(content_type)
+        if file_type is None:
+            raise HTTPException(status_code=400, detail="Invalid file type. Only PDF, PNG and JPEG files are allowed.")
+
+        # Read the body, bailing out as soon as it exceeds the upload limit
+        # (chunks are joined once at the end rather than grown and copied in a bytearray)
+        chunks = []
+        size = 0
+        async for chunk in request.stream():
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > MAX_UPLOAD_SIZE:
+                raise HTTPException(status_code=413, detail="File too large")
+
+        options = {
+            "format": format,
+            "invert": invert,
+            "dither": dither,
+            "threshold": threshold,
+        }
+        if file_type == "pdf":
+            options.update(dpi=dpi, split_pages=split_pages)
 
-        zpl_output = converter.to_zpl()
+        zpl_output = await run_zpl_conversion(file_type, b"".join(chunks), options)
 
         return {
             "status": "success",
             "zpl_content": zpl_output,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": iso_now()
         }
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"HTML conversion failed: {e}")
+        logger.error("Raw conversion failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -715,16 +1762,15 @@ async def convert_html(request: HTMLRequest):
 async def extract_pdf_metadata(file: UploadFile = File(...)):
     """Extract metadata from the first page of the PDF"""
     try:
-        if file.content_type != "application/pdf":
+        if not await is_pdf_upload(file):
             raise HTTPException(status_code=400, detail="Invalid file type. Only PDF files are allowed.")
 
         # Read file content
-        file_content = await file.read()
+        file_content = await read_upload(file)
 
-        # Extract metadata using pdfplumber
-        with pdfplumber.open(io.BytesIO(file_content)) as pdf:
-            first_page = pdf.pages[0]
-            # Convert Decimal to float
+        # Extract metadata using PyMuPDF
+        with fitz.open(stream=file_content, filetype="pdf") as pdf:
+            first_page = pdf[0].rect
             width_in_inches = float(first_page.width / 72)
             height_in_inches = float(first_page.height / 72)
             dpi = 72  # Assuming 72 DPI for PDF
@@ -734,8 +1780,10 @@ async def extract_pdf_metadata(file: UploadFile = File(...)):
             "height": height_in_inches,
             "dpi": dpi
         })
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"PDF metadata extraction failed: {e}")
+        logger.error("PDF metadata extraction failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -753,14 +1801,13 @@ async def preview_zpl(
         height_pixels = int(height * dpi)
 
         # Add label dimensions to ZPL if needed
-        zpl_lines = zpl_content.split('\n')
-        if zpl_lines[0] == '^XA':
-            zpl_lines.insert(1, f'^PW{width_pixels}^LL{height_pixels}^LS0')
-        modified_zpl = '\n'.join(zpl_lines)  # Fix the string join syntax
+        modified_zpl = zpl_content
+        if zpl_content.startswith('^XA\n'):
+            modified_zpl = f'^XA\n^PW{width_pixels}^LL{height_pixels}^LS0\n' + zpl_content[4:]
 
-        # Use ZebrafyZPL for PDF preview
-        converter = ZebrafyZPL(modified_zpl)
-        pdf_data = converter.to_pdf()
+        # Use ZebrafyZPL for PDF preview, rendered in a worker thread so it doesn't
+        # block the event loop. The PDF is already in memory, so it is sent as is.
+        pdf_data = await asyncio.get_running_loop().run_in_executor(None, zpl_to_pdf, modified_zpl)
 
         return Response(
             content=pdf_data,
@@ -768,11 +1815,28 @@ async def preview_zpl(
         )
 
     except Exception as e:
-        logger.error(f"ZPL preview generation failed: {str(e)}")
+        logger.error("ZPL preview generation failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/scale_pdf")
+@app.post("/scale_pdf", summary="Scale PDF to label size",
+          description="Scale the first page of a PDF to width x height inches and return the URL of the "
+                      "scaled PDF (JSON, not the PDF itself). Fetch it from that URL with a GET; the file "
+                      "is named by a hash of the upload and options, so repeat requests get the same URL "
+                      "and conditional GETs are answered with 304 Not Modified.",
+          responses={
+              200: {
+                  "description": "URL of the scaled PDF",
+                  "content": {
+                      "application/json": {
+                          "example": {"scaled_url": "/temp/scaled_0123456789abcdef0123456789abcdef.pdf"}
+                      }
+                  }
+              },
+              400: {"description": "Invalid file type"},
+              413: {"description": "File too large"},
+              500: {"description": "Scaling failed"}
+          })
 async def scale_pdf_endpoint(
     file: UploadFile = File(...),
     width: float = Form(None),
@@ -780,102 +1844,166 @@ async def scale_pdf_endpoint(
     dpi: int = Form(203),
     scaling: str = Form("fit")
 ):
-    """Scale PDF and return the scaled version"""
+    """Scale PDF and return the URL of the scaled version"""
     try:
-        if file.content_type != "application/pdf":
+        if not await is_pdf_upload(file):
             raise HTTPException(status_code=400, detail="Invalid file type. Only PDF files are allowed.")
 
-        file_content = await file.read()
-        scaled_content = await scale_pdf(
-            file_content, 
-            width, 
-            height, 
-            dpi, 
-            scaling == "fit"
-        )
+        file_content = await read_upload(file)
 
-        # Generate unique filename with timestamp
-        timestamp = int(datetime.now().timestamp() * 1000)  # millisecond precision
-        filename = f"scaled_{timestamp}.pdf"
+        # The scaled PDF depends only on the upload and the scale options, so a hash
+        # of both names the output file. It is fetched with a GET from /temp, where
+        # StaticFiles answers conditional requests from its ETag.
+        digest = await content_digest(file_content)
+        digest.update(f"{width}:{height}:{dpi}:{scaling == 'fit'}".encode())
+        filename = f"scaled_{digest.hexdigest()}.pdf"
         filepath = os.path.join(TEMP_DIR, filename)
+        if not os.path.exists(filepath):
+            async with pdf_gate.slot():
+                scaled_content = await scale_pdf(
+                    file_content, 
+                    width, 
+                    height, 
+                    dpi, 
+                    scaling == "fit"
+                )
+            # Write then rename, so concurrent requests never serve a half-written file
+            partial_path = f"{filepath}.{os.getpid()}.{threading.get_ident()}"
+            with open(partial_path, "wb") as f:
+                f.write(scaled_content)
+            os.replace(partial_path, filepath)
+        else:
+            # Refresh the ctime cleanup_old_files checks, so the reused file isn't removed
+            # from under the client, but keep the mtime that /temp's ETag is built from
+            stat = os.stat(filepath)
+            os.utime(filepath, ns=(stat.st_atime_ns, stat.st_mtime_ns))
         
-        # Save scaled content with cache-busting URL
-        with open(filepath, "wb") as f:
-            f.write(scaled_content)
-        
-        # Clean up old files
-        cleanup_old_files(TEMP_DIR)
+        # Clean up old files in a worker thread; the response doesn't wait for it
+        asyncio.get_running_loop().run_in_executor(None, cleanup_old_files, TEMP_DIR)
 
-        # Return URL with cache-busting query parameter
         return Response(
-            content=scaled_content,
-            media_type="application/pdf",
-            headers={
-                "Cache-Control": "no-cache, no-store, must-revalidate",
-                "Pragma": "no-cache",
-                "Expires": "0"
-            }
+            content=orjson.dumps({"scaled_url": f"/temp/{filename}"}),
+            media_type="application/json"
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"PDF scaling failed: {e}")
+        logger.error("PDF scaling failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e))  # Fix syntax error
 
 
 @app.post("/analyze_pdf", summary="Analyze PDF Elements", 
-          description="Extract text blocks, images, and barcodes from PDF")
+          description="Extract text blocks, images, and barcodes from PDF. "
+                      "Set all_pages to analyze every page, returned as a list under \"pages\"; "
+                      "PDFs longer than MAX_ANALYZE_PAGES are cut off there and marked \"truncated\". "
+                      "Set columnar to return text_blocks as parallel text/bbox/font/size lists.")
 async def analyze_pdf(
     file: UploadFile = File(...),
-    page: int = Form(0)
+    page: int = Form(0),
+    all_pages: bool = Form(False),
+    columnar: bool = Form(False)
 ):
     """Analyze PDF elements including text, images, and barcodes"""
     try:
-        if file.content_type != "application/pdf":
+        if not await is_pdf_upload(file):
             raise HTTPException(status_code=400, detail="Invalid file type")
 
-        content = await file.read()
-        analyzer = PDFAnalyzer(content)
-        
-        try:
-            result = analyzer.analyze_page(page)
-            # Convert set to list for JSON serialization
-            result['fonts'] = list(result['fonts'])
-            return JSONResponse(
-                content=json.loads(
-                    json.dumps(result, default=json_serial)
-                )
-            )
-        finally:
-            analyzer.close()
+        check_upload_size(file)
+        # Uploads large enough to have been spooled to disk are hashed and opened
+        # from there, instead of first being copied into memory in full
+        path = spooled_upload_path(file)
+        if path is not None:
+            content = None
+            digest = await upload_digest(file)
+        else:
+            content = await read_upload(file)
+            digest = (await content_digest(content)).digest()
+
+        key = (digest, None if all_pages else page, columnar)
+        payload = _analysis_response_cache.get(key)
+        if payload is None:
+            async with pdf_gate.slot():
+                if all_pages:
+                    if path is not None:
+                        doc = fitz.open(path, filetype="pdf")
+                    else:
+                        doc = fitz.open(stream=content, filetype="pdf")
+                    with doc:
+                        page_count = doc.page_count
+                    results = await analyze_pdf_pages(content, min(page_count, MAX_ANALYZE_PAGES),
+                                                      filename=path)
+                    payload = orjson.dumps({
+                        "pages": [analysis_response(result, columnar) for result in results],
+                        "page_count": page_count,
+                        "truncated": page_count > MAX_ANALYZE_PAGES
+                    })
+                else:
+                    results = [await analyze_pdf_page(content, page, filename=path)]
+                    payload = orjson.dumps(analysis_response(results[0], columnar))
+            # Only clean analyses are cached; errors (e.g. a page out of range) are recomputed
+            if not any(result['errors'] for result in results):
+                _analysis_response_cache.put(key, payload)
 
+        return Response(content=payload, media_type="application/json")
+
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"PDF analysis failed: {str(e)}")
+        logger.error("PDF analysis failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e))  # Fix syntax error
 
 
+@app.post("/analyze_pdf/stream", summary="Stream PDF Analysis",
+          description="Analyze one PDF page and stream the results as NDJSON, one "
+                      "{\"kind\": ..., \"value\": ...} object per line. Kinds are text, font, "
+                      "image, barcode and error; text is sent before images are decoded.")
+async def analyze_pdf_stream(
+    file: UploadFile = File(...),
+    page: int = Form(0)
+):
+    """Stream PDF elements as they are found"""
+    try:
+        if not await is_pdf_upload(file):
+            raise HTTPException(status_code=400, detail="Invalid file type")
+        # The slot is taken once the stream starts; turn the request away now if the
+        # server is already full, while a 503 can still be sent
+        pdf_gate.check()
+
+        # The analyzer opens the spool file itself, so it stays readable after the upload is closed
+        check_upload_size(file)
+        path = spooled_upload_path(file)
+        if path is not None:
+            analyzer = PDFAnalyzer(filename=path)
+        else:
+            analyzer = PDFAnalyzer(await read_upload(file))
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("PDF analysis failed: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return StreamingResponse(stream_analysis_ndjson(analyzer, page), media_type="application/x-ndjson")
+
+
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8000))
-    logger.info(f"Starting server on port {port}")
-    uvicorn.run(app, host="0.0.0.0", port=port)
-
-async def create_image_only_pdf(content: bytes, images: list, width: float, height: float, dpi: int) -> bytes:
-    """Create a new PDF containing only the specified images"""
-    doc = fitz.open(stream=content, filetype="pdf")
-    new_doc = fitz.open()
-    page = new_doc.new_page(width=width*72, height=height*72)
-    
-    for img in images:
-        if img.get('position'):
-            # Copy image to new position
-            page.show_pdf_page(
-                fitz.Rect(
-                    img['position']['x0'],
-                    img['position']['y0'],
-                    img['position']['x1'],
-                    img['position']['y1']
-                ),
-                doc,
-                0
-            )
-    
-    return new_doc.tobytes()
+    logger.info("Starting server on port %s", port)
+    if os.getenv("RELOAD", "").lower() in ("1", "true", "yes"):
+        # Development mode: auto-reload only works with a single worker, which
+        # then gets every CPU for its process pool
+        os.environ["WEB_WORKERS"] = "1"
+        uvicorn.run("main:app", host="0.0.0.0", port=port, reload=True)
+    else:
+        uvicorn.run(
+            "main:app",
+            host="0.0.0.0",
+            port=port,
+            workers=WEB_WORKERS,
+            loop="uvloop",
+            http="httptools",
+            # Answer 503 past this many open connections/tasks per worker rather than queueing
+            limit_concurrency=int(os.getenv("LIMIT_CONCURRENCY", 64)),
+            timeout_keep_alive=int(os.getenv("TIMEOUT_KEEP_ALIVE", 5))
+        )